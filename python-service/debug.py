@@ -0,0 +1,12 @@
+import cv2
+import numpy as np
+from pathlib import Path
+
+# SET TO FALSE FOR PRODUCTION TO REMOVE STALLS
+ENABLE_DEBUG = False
+DEBUG_DIR = Path(__file__).parent / "debug"
+
+def debug_save(name: str, img: np.ndarray):
+    if ENABLE_DEBUG:
+        DEBUG_DIR.mkdir(exist_ok=True)
+        cv2.imwrite(str(DEBUG_DIR / name), img)
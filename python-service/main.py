@@ -1,9 +1,30 @@
+import asyncio
+import cv2
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from typing import Optional
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from preprocessing import preprocess_image
 from scanner import scan_barcode
 
-app = FastAPI()
+scan_pool: Optional[ProcessPoolExecutor] = None
+
+def _create_scan_pool() -> ProcessPoolExecutor:
+    # One worker per core already uses every CPU, so OpenCV must not start its own thread pool in each
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=cv2.setNumThreads, initargs=(1,))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Decoding is CPU-bound and pyzbar holds the GIL, so scans run in worker processes
+    global scan_pool
+    scan_pool = _create_scan_pool()
+    yield
+    scan_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -12,6 +33,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _do_scan(contents: bytes, require_extension: bool) -> dict:
+    # Returns: (full_original, enhanced_full, cropped_region or None, crop_box or None, detected_upc or None)
+    original, enhanced, cropped, crop_box, detected_upc = preprocess_image(contents)
+
+    # Pass everything to scanner - it will try full image first, then cropped as fallback
+    return scan_barcode(original, enhanced, cropped, crop_box, detected_upc, require_extension=require_extension)
+
 @app.get("/")
 def root():
     return {"status": "Python barcode service running"}
@@ -21,15 +49,22 @@ def health_check():
     return {"status": "ok"}
 
 @app.post("/scan")
-async def scan_upc(image: UploadFile = File(...)):
+async def scan_upc(image: UploadFile = File(...), require_extension: bool = False):
+    global scan_pool
     try:
         contents = await image.read()
 
-        # Returns: (full_original, enhanced_full, cropped_region or None)
-        original, enhanced, cropped = preprocess_image(contents)
-
-        # Pass all three to scanner - it will try full image first, then cropped as fallback
-        result = scan_barcode(original, enhanced, cropped)
+        loop = asyncio.get_running_loop()
+        pool = scan_pool
+        try:
+            result = await loop.run_in_executor(pool, _do_scan, contents, require_extension)
+        except BrokenProcessPool:
+            # A worker died (native crash or OOM kill); a broken pool rejects every later job,
+            # so swap in a fresh one unless a concurrent request already has
+            if scan_pool is pool:
+                scan_pool = _create_scan_pool()
+                pool.shutdown(wait=False)
+            raise HTTPException(status_code=500, detail="Scanner worker crashed")
 
         if not result['main']:
             raise HTTPException(status_code=400, detail="No barcode found")
@@ -1,62 +1,117 @@
 import cv2
+import io
 import numpy as np
+from PIL import Image
 from typing import Optional, Tuple
-from pathlib import Path
-
-# SET TO FALSE FOR PRODUCTION
-ENABLE_DEBUG = False
-DEBUG_DIR = Path(__file__).parent / "debug"
-
-def preprocess_image(image_bytes: bytes) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+from debug import debug_save
+from turbojpeg import TurboJPEG, TJPF_GRAY, TJFLAG_FASTDCT
+
+# Longest side to scan at. UPC bars stay well above 2px wide at this size,
+# and phone photos (often 4000x3000) are shrunk before any other work.
+MAX_DIMENSION = 1600
+
+# EXIF orientation tag value -> rotation that makes the image upright
+# (the mirrored orientations 2/4/5/7 don't come out of phone cameras)
+EXIF_ROTATIONS = {
+    3: cv2.ROTATE_180,
+    6: cv2.ROTATE_90_CLOCKWISE,
+    8: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+
+# OpenCV detector types that correspond to the scanner's main UPC symbols
+DETECTOR_UPC_TYPES = {"EAN_13", "UPC_A", "UPC_E"}
+
+# Built once per process; all are reused across requests
+_TJ = TurboJPEG()
+_DETECTOR = cv2.barcode.BarcodeDetector()
+_CLAHE = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+
+def preprocess_image(image_bytes: bytes) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], Optional[Tuple[int, int, int, int]], Optional[str]]:
     """
-    Returns: (full_original, enhanced_full, cropped_region or None)
+    Returns: (full_original, enhanced_full, cropped_region or None, crop_box (x, y, w, h) or None,
+              main UPC already decoded by the barcode detector or None)
 
     Key change: Returns the FULL original image, not cropped.
     Cropping is now optional and returned separately for fallback use.
     """
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if img is None: raise ValueError("Could not decode image")
+    # Everything downstream is grayscale, so never decode colour
+    gray_full = decode_image(image_bytes)
 
-    if ENABLE_DEBUG:
-        DEBUG_DIR.mkdir(exist_ok=True)
-        cv2.imwrite(str(DEBUG_DIR / "01_original.png"), img)
+    h, w = gray_full.shape[:2]
+    scale = min(1.0, MAX_DIMENSION / max(h, w))
+    if scale < 1.0:
+        gray_full = cv2.resize(gray_full, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        h, w = gray_full.shape[:2]
 
-    h, w = img.shape[:2]
+    # Turn phone photos upright (turbojpeg ignores EXIF, and OpenCV is told to)
+    rotation = EXIF_ROTATIONS.get(exif_orientation(image_bytes))
+    if rotation is not None:
+        gray_full = cv2.rotate(gray_full, rotation)
+        h, w = gray_full.shape[:2]
+
+    debug_save("01_original.png", gray_full)
 
     # 1. Create enhanced version of FULL image (for Tier 2 scanning)
-    gray_full = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    enhanced_full = clahe.apply(gray_full)
+    enhanced_full = _CLAHE.apply(gray_full)
 
-    if ENABLE_DEBUG:
-        cv2.imwrite(str(DEBUG_DIR / "02_enhanced_full.png"), enhanced_full)
+    debug_save("02_enhanced_full.png", enhanced_full)
 
-    # 2. Attempt focused detection for fallback cropping
-    cropped = detect_barcode_region(img)
+    # 2. Attempt focused detection for fallback cropping (this may decode the main UPC outright)
+    cropped, crop_box, detected_upc = detect_barcode_region(gray_full)
 
     # Only use crop if it's reasonably sized (not most of the image)
     if cropped is not None and (cropped.shape[0] * cropped.shape[1]) > (h * w * 0.6):
-        cropped = None  # Crop is too large, not useful
+        cropped, crop_box = None, None  # Crop is too large, not useful
 
-    if ENABLE_DEBUG and cropped is not None:
-        cv2.imwrite(str(DEBUG_DIR / "03_cropped.png"), cropped)
+    if cropped is not None:
+        debug_save("03_cropped.png", cropped)
 
-    return img, enhanced_full, cropped
+    return gray_full, enhanced_full, cropped, crop_box, detected_upc
 
-def detect_barcode_region(img: np.ndarray, extra_right_padding: float = 0.3) -> Optional[np.ndarray]:
+def decode_image(image_bytes: bytes) -> np.ndarray:
+    """
+    Decode to grayscale: JPEGs with libjpeg-turbo (fast DCT), everything else with OpenCV.
+    Pixels come back in stored order for both decoders; EXIF orientation is left to preprocess_image.
+    """
+    if image_bytes[:2] == b'\xff\xd8':
+        try:
+            return _TJ.decode(image_bytes, pixel_format=TJPF_GRAY, flags=TJFLAG_FASTDCT)[:, :, 0]
+        except OSError:
+            pass  # Let OpenCV have a go at JPEGs turbojpeg rejects
+
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    # Orientation is applied by preprocess_image for both decoders, so OpenCV must not apply it too
+    img = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None: raise ValueError("Could not decode image")
+    return img
+
+def exif_orientation(image_bytes: bytes) -> int:
+    """Read the EXIF orientation tag (1 = upright) without decoding any pixels."""
+    try:
+        return Image.open(io.BytesIO(image_bytes)).getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+
+def detect_barcode_region(img: np.ndarray, extra_right_padding: float = 0.3) -> Tuple[Optional[np.ndarray], Optional[Tuple[int, int, int, int]], Optional[str]]:
     """
     Detect barcode region with extra padding on the right side to capture extensions.
+    Returns (cropped_region, (x, y, w, h), decoded_upc); any of them may be None.
+    The box lets callers cut the same region from other versions of img, and
+    decoded_upc is set when OpenCV's detector could already read the main barcode.
 
     Args:
         img: Input image
         extra_right_padding: Extra padding ratio for right side (default 30% to catch extension)
     """
     try:
-        detector = cv2.barcode.BarcodeDetector()
-        retval, points = detector.detect(img)
+        decoded, decoded_info, decoded_type, points = _DETECTOR.detectAndDecodeWithType(img)
+
+        decoded_upc = None
+        if decoded and decoded_info[0] and decoded_type[0] in DETECTOR_UPC_TYPES:
+            decoded_upc = decoded_info[0]
 
-        if retval and points is not None:
+        # Points come back even when the symbol couldn't be decoded
+        if points is not None and len(points):
             pts = points[0].astype(int)
             x, y, w, h = cv2.boundingRect(pts)
 
@@ -72,10 +127,10 @@ def detect_barcode_region(img: np.ndarray, extra_right_padding: float = 0.3) ->
             new_w = min(img.shape[1] - x, w + pad_w + extra_right)
             new_h = min(img.shape[0] - y, h + (pad_h * 2))
 
-            return img[y:y+new_h, x:x+new_w]
+            return img[y:y+new_h, x:x+new_w], (x, y, new_w, new_h), decoded_upc
     except:
         pass
-    return None
+    return None, None, None
 
 def get_extended_region(img: np.ndarray, main_barcode_location: tuple) -> Optional[np.ndarray]:
     """
@@ -1,23 +1,50 @@
 import cv2
 import numpy as np
-from pyzbar.pyzbar import decode, ZBarSymbol
-from pathlib import Path
-from typing import Optional
-
-# SET TO FALSE FOR PRODUCTION TO REMOVE STALLS
-ENABLE_DEBUG = False
-DEBUG_DIR = Path(__file__).parent / "debug"
+from ctypes import cast, c_void_p
+from pyzbar.pyzbar import ZBarSymbol, _FOURCC, _decode_symbols, _image, _symbols_for_image
+from pyzbar.pyzbar_error import PyZbarError
+from pyzbar.wrapper import (
+    ZBarConfig, zbar_image_scanner_create, zbar_image_scanner_set_config, zbar_image_set_data,
+    zbar_image_set_format, zbar_image_set_size, zbar_scan_image,
+)
+import threading
+import time
+from debug import ENABLE_DEBUG, debug_save
+from typing import Optional, Tuple
 
 BARCODE_TYPES = [
     ZBarSymbol.UPCA, ZBarSymbol.UPCE, ZBarSymbol.EAN13, ZBarSymbol.EAN5
 ]
 
+# zbar scans every row and column (X/Y density 1), so one pass reads a barcode at any
+# right-angle rotation. Only Tier 6's row-oriented blur and deskew still need the 90° view.
+ROTATIONS = [0, 90]
+
+# Once the main UPC is found, how long Tiers 2-3 may keep looking for the extension
+EXTENSION_SEARCH_BUDGET_MS = 200
+
+# Longest side check_image_quality runs Canny at (half of a full 1600px upload).
+# At a quarter size thin bars merge and edge density stops tracking the full image.
+EDGE_CHECK_DIMENSION = 800
+
+_CLAHE = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+
 def check_image_quality(gray: np.ndarray) -> dict:
     """Quick quality check to detect clearly unreadable images."""
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    # Laplacian variance depends on scale (downsampling hides blur), so it stays at full resolution.
+    # int16 holds every Laplacian value of a uint8 image; meanStdDev gives the variance in one pass
+    lap = cv2.Laplacian(gray, cv2.CV_16S)
+    _, lap_std = cv2.meanStdDev(lap)
+    laplacian_var = float(lap_std[0, 0]) ** 2
     contrast = gray.std()
-    edges = cv2.Canny(gray, 50, 150)
-    edge_density = np.count_nonzero(edges) / edges.size
+
+    # Canny runs on a smaller copy. Edge pixels per unit area grow as 1/scale when an image
+    # shrinks, so multiplying by scale keeps the density comparable to the full-size threshold.
+    h, w = gray.shape[:2]
+    scale = min(1.0, EDGE_CHECK_DIMENSION / max(h, w))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    edges = cv2.Canny(small, 50, 150)
+    edge_density = np.count_nonzero(edges) / edges.size * scale
 
     is_scannable = (
         laplacian_var > 50 and
@@ -32,86 +59,100 @@ def check_image_quality(gray: np.ndarray) -> dict:
         'edge_density': edge_density
     }
 
-def debug_save(name: str, img: np.ndarray):
-    if ENABLE_DEBUG:
-        DEBUG_DIR.mkdir(exist_ok=True)
-        cv2.imwrite(str(DEBUG_DIR / name), img)
-
-def scan_barcode(original: np.ndarray, enhanced: np.ndarray, cropped: Optional[np.ndarray] = None) -> dict:
+def scan_barcode(original: np.ndarray, enhanced: np.ndarray, cropped: Optional[np.ndarray] = None,
+                 crop_box: Optional[Tuple[int, int, int, int]] = None, detected_upc: Optional[str] = None,
+                 require_extension: bool = False) -> dict:
     """
     Scan for UPC barcode and 5-digit extension.
 
     Strategy (prioritizes finding both main + extension):
-    1. TIER 1: Full image, all 4 rotations (best chance for extension)
-    2. TIER 2: Enhanced full image, all 4 rotations
+    1. TIER 1: Full image (best chance for extension)
+    2. TIER 2: Enhanced full image
     3. TIER 3: Fixed thresholds on full image
     4. TIER 4: If we have a crop, try it (for hard-to-read main barcodes)
     5. TIER 5: Small angle corrections
     6. TIER 6: Deep processing (upscale, deskew)
 
     If main UPC found but no extension, keep trying other methods for extension only.
+    Unless require_extension is set, that search stops after Tier 3 once
+    EXTENSION_SEARCH_BUDGET_MS has passed, and Tiers 5-6 are skipped.
+
+    detected_upc is a main UPC already read by OpenCV's barcode detector. It seeds
+    the result; if the extension isn't required, it is returned without running any tier.
     """
     # Prepare grayscale versions
     gray_full = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY) if len(original.shape) == 3 else original
     gray_enhanced = enhanced  # Already grayscale
 
+    best_result = {'main': detected_upc, 'extension': None}
+    main_found_at = time.perf_counter() if detected_upc else None
+    if detected_upc and not require_extension:
+        return best_result
+
     # Quality check
     quality = check_image_quality(gray_full)
     if ENABLE_DEBUG:
         print(f"Quality: blur={quality['blur_score']:.1f}, contrast={quality['contrast']:.1f}, edges={quality['edge_density']:.4f}")
 
-    best_result = {'main': None, 'extension': None}
+    # === TIER 1: Full image (BEST for extension) ===
+    result = try_decode(gray_full)
+    best_result = merge_results(best_result, result)
+    if best_result['main'] and best_result['extension']:
+        debug_save("success_tier1.png", gray_full)
+        return best_result
 
-    # === TIER 1: Full image at all 4 rotations (BEST for extension) ===
-    for angle in [0, 90, 180, 270]:
-        img = rotate_image(gray_full, angle)
-        result = try_decode(img)
-        best_result = merge_results(best_result, result)
-        if best_result['main'] and best_result['extension']:
-            debug_save(f"success_tier1_rot{angle}.png", img)
-            return best_result
+    if best_result['main'] and main_found_at is None:
+        main_found_at = time.perf_counter()
+
+    # === TIER 2: Enhanced full image ===
+    result = try_decode(gray_enhanced)
+    best_result = merge_results(best_result, result)
+    if best_result['main'] and best_result['extension']:
+        debug_save("success_tier2.png", gray_enhanced)
+        return best_result
+
+    if best_result['main'] and main_found_at is None:
+        main_found_at = time.perf_counter()
 
-    # === TIER 2: Enhanced full image at all rotations ===
-    for angle in [0, 90, 180, 270]:
-        img = rotate_image(gray_enhanced, angle)
+    # === TIER 3: Fixed thresholds on full image ===
+    # Thresholded images go into one preallocated buffer
+    img = np.empty_like(gray_full)
+    for thresh_val in [140, 160, 180]:
+        cv2.threshold(gray_full, thresh_val, 255, cv2.THRESH_BINARY, dst=img)
         result = try_decode(img)
         best_result = merge_results(best_result, result)
         if best_result['main'] and best_result['extension']:
-            debug_save(f"success_tier2_rot{angle}.png", img)
+            debug_save(f"success_tier3_thresh{thresh_val}.png", img)
             return best_result
 
-    # === TIER 3: Fixed thresholds on full image ===
-    for thresh_val in [140, 160, 180]:
-        _, thresh = cv2.threshold(gray_full, thresh_val, 255, cv2.THRESH_BINARY)
-        for angle in [0, 90, 180, 270]:
-            img = rotate_image(thresh, angle)
-            result = try_decode(img)
-            best_result = merge_results(best_result, result)
-            if best_result['main'] and best_result['extension']:
-                debug_save(f"success_tier3_thresh{thresh_val}_rot{angle}.png", img)
-                return best_result
+    if best_result['main'] and main_found_at is None:
+        main_found_at = time.perf_counter()
+
+    # Past the cheap tiers, stop hunting for an optional extension once the budget is spent
+    if main_found_at is not None and not require_extension:
+        if (time.perf_counter() - main_found_at) * 1000 >= EXTENSION_SEARCH_BUDGET_MS:
+            return best_result
 
     # === TIER 4: Try cropped region if available (helps with hard-to-read main barcodes) ===
     if cropped is not None:
         gray_crop = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY) if len(cropped.shape) == 3 else cropped
-        for angle in [0, 90, 180, 270]:
-            img = rotate_image(gray_crop, angle)
-            result = try_decode(img)
-            best_result = merge_results(best_result, result)
-            if best_result['main'] and best_result['extension']:
-                debug_save(f"success_tier4_crop_rot{angle}.png", img)
-                return best_result
-
-        # Also try enhanced crop
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced_crop = clahe.apply(gray_crop)
-        for angle in [0, 90, 180, 270]:
-            img = rotate_image(enhanced_crop, angle)
-            result = try_decode(img)
-            best_result = merge_results(best_result, result)
-            if best_result['main'] and best_result['extension']:
-                debug_save(f"success_tier4_crop_enh_rot{angle}.png", img)
-                return best_result
+        result = try_decode(gray_crop)
+        best_result = merge_results(best_result, result)
+        if best_result['main'] and best_result['extension']:
+            debug_save("success_tier4_crop.png", gray_crop)
+            return best_result
+
+        # Also try enhanced crop, cut from the already-equalized full image when we know where the crop is
+        if crop_box is not None:
+            x, y, w, h = crop_box
+            enhanced_crop = gray_enhanced[y:y+h, x:x+w]
+        else:
+            enhanced_crop = _CLAHE.apply(gray_crop)
+        result = try_decode(enhanced_crop)
+        best_result = merge_results(best_result, result)
+        if best_result['main'] and best_result['extension']:
+            debug_save("success_tier4_crop_enh.png", enhanced_crop)
+            return best_result
 
     # Early exit if image quality is too low and we still have nothing
     if not quality['scannable'] and not best_result['main']:
@@ -119,9 +160,17 @@ def scan_barcode(original: np.ndarray, enhanced: np.ndarray, cropped: Optional[n
             print("Skipping expensive tiers - image quality too low")
         return best_result
 
+    # Tiers 5-6 mostly rescue hard-to-read main barcodes, not the small extension
+    if best_result['main'] and not require_extension:
+        return best_result
+
+    # Tiers 5-6 write every intermediate image into these instead of allocating per op
+    scratch1 = np.empty_like(gray_full)
+    scratch2 = np.empty_like(gray_full)
+
     # === TIER 5: Small angle corrections ===
     for small_angle in [-5, -3, 3, 5]:
-        corrected = rotate_by_angle(gray_full, small_angle)
+        corrected = rotate_by_angle(gray_full, small_angle, dst=scratch1)
         result = try_decode(corrected)
         best_result = merge_results(best_result, result)
         if best_result['main'] and best_result['extension']:
@@ -129,17 +178,20 @@ def scan_barcode(original: np.ndarray, enhanced: np.ndarray, cropped: Optional[n
             return best_result
 
     # === TIER 6: Deep processing (expensive) ===
-    for angle in [0, 90]:
+    for angle in ROTATIONS:
         img = rotate_image(gray_full, angle)
 
+        # The 90° view has the same pixel count, so the buffers only need reshaping
+        scratch = (scratch1.reshape(img.shape), scratch2.reshape(img.shape))
+
         # Upscale and threshold
-        result = upscale_and_clean(img, f"deep_{angle}")
+        result = upscale_and_clean(img, f"deep_{angle}", scratch)
         best_result = merge_results(best_result, result)
         if best_result['main'] and best_result['extension']:
             return best_result
 
         # Deskew
-        result = deskew_and_decode(img)
+        result = deskew_and_decode(img, dst=scratch[0])
         best_result = merge_results(best_result, result)
         if best_result['main'] and best_result['extension']:
             return best_result
@@ -153,76 +205,115 @@ def merge_results(existing: dict, new: dict) -> dict:
         'extension': existing['extension'] or new['extension']
     }
 
-def rotate_by_angle(img: np.ndarray, angle: float) -> np.ndarray:
+def rotate_by_angle(img: np.ndarray, angle: float, dst: Optional[np.ndarray] = None) -> np.ndarray:
     """Rotate image by arbitrary angle (for small corrections)"""
     h, w = img.shape[:2]
     matrix = cv2.getRotationMatrix2D((w//2, h//2), angle, 1.0)
-    return cv2.warpAffine(img, matrix, (w, h), flags=cv2.INTER_LINEAR, borderValue=255)
+    return cv2.warpAffine(img, matrix, (w, h), dst=dst, flags=cv2.INTER_LINEAR, borderValue=255)
 
 def rotate_image(img: np.ndarray, angle: int) -> np.ndarray:
     if angle == 90: return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
-    if angle == 180: return cv2.rotate(img, cv2.ROTATE_180)
-    if angle == 270: return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
     return img
 
-def upscale_and_clean(gray: np.ndarray, prefix: str) -> dict:
+def upscale_and_clean(gray: np.ndarray, prefix: str,
+                      scratch: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> dict:
+    """scratch: two buffers shaped like gray that every intermediate image is written into."""
     h, w = gray.shape[:2]
     if w < 400:
-        scale = 3
-        img = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+        scale = 2
+        upscaled = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+        # Unsharp mask restores the bar edges the interpolation softens
+        img = cv2.addWeighted(upscaled, 1.5, cv2.GaussianBlur(upscaled, (0, 0), 1.0), -0.5, 0)
+        scratch = None  # Upscaled image no longer fits the caller's buffers
     else:
         img = gray
 
+    buf_a, buf_b = scratch if scratch is not None else (np.empty_like(img), np.empty_like(img))
+
     # Try fixed threshold values
     for thresh_val in [140, 160, 180, 120]:
-        _, thresh = cv2.threshold(img, thresh_val, 255, cv2.THRESH_BINARY)
-        result = try_decode(thresh)
+        cv2.threshold(img, thresh_val, 255, cv2.THRESH_BINARY, dst=buf_a)
+        result = try_decode(buf_a)
         if result['main']:
             return result
 
     # Otsu threshold fallback
-    blurred = cv2.GaussianBlur(img, (3, 3), 0)
-    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    cv2.GaussianBlur(img, (3, 3), 0, dst=buf_b)
+    cv2.threshold(buf_b, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=buf_a)
 
-    result = try_decode(thresh)
+    result = try_decode(buf_a)
     if not result['main']:
-        result = try_decode(cv2.bitwise_not(thresh))
+        result = try_decode(cv2.bitwise_not(buf_a, dst=buf_b))
 
     if not result['main']:
         # Horizontal blur (good for motion blur)
-        h_blur = cv2.blur(img, (5, 1))
-        _, thresh_h = cv2.threshold(h_blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        result = try_decode(thresh_h)
+        cv2.blur(img, (5, 1), dst=buf_b)
+        cv2.threshold(buf_b, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=buf_a)
+        result = try_decode(buf_a)
 
     return result
 
-def deskew_and_decode(gray: np.ndarray) -> dict:
+def deskew_and_decode(gray: np.ndarray, dst: Optional[np.ndarray] = None) -> dict:
     small = cv2.resize(gray, (0,0), fx=0.5, fy=0.5)
     edges = cv2.Canny(small, 50, 150)
     lines = cv2.HoughLines(edges, 1, np.pi / 180, 80)
 
     if lines is None: return {'main': None, 'extension': None}
 
-    angles = []
-    for line in lines:
-        theta = line[0][1]
-        deg = np.degrees(theta)
-        if deg < 30: angles.append(deg)
-        elif deg > 150: angles.append(deg - 180)
+    # Keep near-vertical lines, folding 150-180° onto -30-0°
+    deg = np.degrees(lines[:, 0, 1])
+    angles = np.where(deg > 150, deg - 180, deg)[(deg < 30) | (deg > 150)]
 
-    if not angles: return {'main': None, 'extension': None}
+    if angles.size == 0: return {'main': None, 'extension': None}
 
     median_angle = np.median(angles)
     if abs(median_angle) < 0.5: return {'main': None, 'extension': None}
 
     h, w = gray.shape[:2]
     matrix = cv2.getRotationMatrix2D((w//2, h//2), median_angle, 1.0)
-    deskewed = cv2.warpAffine(gray, matrix, (w, h), flags=cv2.INTER_LINEAR)
+    deskewed = cv2.warpAffine(gray, matrix, (w, h), dst=dst, flags=cv2.INTER_LINEAR)
 
     return try_decode(deskewed)
 
+def _create_scanner():
+    """zbar image scanner limited to BARCODE_TYPES, scanning every row and column."""
+    scanner = zbar_image_scanner_create()
+    if not scanner:
+        raise PyZbarError('Could not create image scanner')
+
+    # Disable all but the symbols of interest
+    for symbol in set(ZBarSymbol).difference(BARCODE_TYPES):
+        zbar_image_scanner_set_config(scanner, symbol, ZBarConfig.CFG_ENABLE, 0)
+    for symbol in BARCODE_TYPES:
+        zbar_image_scanner_set_config(scanner, symbol, ZBarConfig.CFG_ENABLE, 1)
+    zbar_image_scanner_set_config(scanner, 0, ZBarConfig.CFG_X_DENSITY, 1)
+    zbar_image_scanner_set_config(scanner, 0, ZBarConfig.CFG_Y_DENSITY, 1)
+    return scanner
+
+# One configured scanner per process, shared by every decode. zbar scanners
+# aren't thread-safe, so calls are serialized.
+_SCANNER = _create_scanner()
+_SCANNER_LOCK = threading.Lock()
+
+def zbar_decode(image: np.ndarray) -> list:
+    """
+    pyzbar's decode() for grayscale arrays, reusing the module's configured
+    scanner instead of creating and configuring one per call.
+    """
+    height, width = image.shape[:2]
+    pixels = image.tobytes()
+
+    with _SCANNER_LOCK:
+        with _image() as zimg:
+            zbar_image_set_format(zimg, _FOURCC['L800'])
+            zbar_image_set_size(zimg, width, height)
+            zbar_image_set_data(zimg, cast(pixels, c_void_p), len(pixels), None)
+            if zbar_scan_image(_SCANNER, zimg) < 0:
+                raise PyZbarError('Unsupported image format')
+            return list(_decode_symbols(_symbols_for_image(zimg)))
+
 def try_decode(image: np.ndarray) -> dict:
-    barcodes = decode(image, symbols=BARCODE_TYPES)
+    barcodes = zbar_decode(image)
     result = {'main': None, 'extension': None}
     for barcode in barcodes:
         data = barcode.data.decode('utf-8')
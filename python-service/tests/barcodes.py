@@ -0,0 +1,59 @@
+"""Synthetic UPC-A and EAN-5 add-on images for the scanner tests."""
+from typing import Optional
+import numpy as np
+
+L_CODES = ["0001101", "0011001", "0010011", "0111101", "0100011",
+           "0110001", "0101111", "0111011", "0110111", "0001011"]
+G_CODES = ["0100111", "0110011", "0011011", "0100001", "0011101",
+           "0111001", "0000101", "0010001", "0001001", "0010111"]
+R_CODES = ["1110010", "1100110", "1101100", "1000010", "1011100",
+           "1001110", "1010000", "1000100", "1001000", "1110100"]
+
+# EAN-13 leading digit -> L/G parity of the left half (UPC-A is EAN-13 with a leading 0)
+EAN13_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+                "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+# EAN-5 checksum -> L/G parity of its five digits
+EAN5_PARITY = ["GGLLL", "GLGLL", "GLLGL", "GLLLG", "LGGLL",
+               "LLGGL", "LLLGG", "LGLGL", "LGLLG", "LLGLG"]
+
+MODULE = 4        # Pixels per bar module
+QUIET = 12        # Quiet zone modules either side of a symbol
+ADDON_GAP = 9     # Modules between the UPC's end guard and the add-on
+BAR_HEIGHT = 200
+MARGIN = 40
+
+def upca_modules(upc: str) -> str:
+    code = "0" + upc
+    bits = "101"
+    for digit, parity in zip(code[1:7], EAN13_PARITY[int(code[0])]):
+        bits += (L_CODES if parity == "L" else G_CODES)[int(digit)]
+    bits += "01010"
+    for digit in code[7:]:
+        bits += R_CODES[int(digit)]
+    return bits + "101"
+
+def ean5_modules(extension: str) -> str:
+    digits = [int(d) for d in extension]
+    checksum = (3 * (digits[0] + digits[2] + digits[4]) + 9 * (digits[1] + digits[3])) % 10
+    bits = "01011"
+    for i, (digit, parity) in enumerate(zip(digits, EAN5_PARITY[checksum])):
+        if i:
+            bits += "01"
+        bits += (L_CODES if parity == "L" else G_CODES)[digit]
+    return bits
+
+def render(upc: str, extension: Optional[str] = None) -> np.ndarray:
+    """Black bars on white, with the add-on to the right of the UPC and a little shorter."""
+    bars = [(upca_modules(upc), 0)]
+    if extension:
+        bars.append(("0" * ADDON_GAP + ean5_modules(extension), BAR_HEIGHT // 6))
+    width = sum(len(b) for b, _ in bars) + 2 * QUIET
+
+    img = np.full((BAR_HEIGHT + 2 * MARGIN, width * MODULE), 255, np.uint8)
+    x = QUIET
+    for bits, top in bars:
+        for bit in bits:
+            if bit == "1":
+                img[MARGIN + top:MARGIN + BAR_HEIGHT, x * MODULE:(x + 1) * MODULE] = 0
+            x += 1
+    return img
@@ -0,0 +1,103 @@
+import pytest
+
+# pyzbar raises ImportError at import time when libzbar itself isn't installed
+pytest.importorskip("pyzbar.pyzbar", exc_type=ImportError)
+
+import scanner
+from barcodes import render
+
+UPC = "036000291452"
+EXTENSION = "00111"
+
+def count_decodes(monkeypatch) -> list:
+    """Wrap try_decode and return the list it records each decoded image into."""
+    calls = []
+    real_try_decode = scanner.try_decode
+
+    def recording_try_decode(image):
+        calls.append(image)
+        return real_try_decode(image)
+
+    monkeypatch.setattr(scanner, "try_decode", recording_try_decode)
+    return calls
+
+def forbid(monkeypatch, *names):
+    for name in names:
+        def fail(*args, name=name, **kwargs):
+            raise AssertionError(f"{name} should not have run")
+
+        monkeypatch.setattr(scanner, name, fail)
+
+def test_finds_upc_and_extension():
+    img = render(UPC, EXTENSION)
+
+    assert scanner.scan_barcode(img, img) == {'main': UPC, 'extension': EXTENSION}
+
+def test_optional_extension_skips_tiers_5_and_6(monkeypatch):
+    img = render(UPC)
+    forbid(monkeypatch, "rotate_by_angle", "upscale_and_clean", "deskew_and_decode")
+
+    assert scanner.scan_barcode(img, img) == {'main': UPC, 'extension': None}
+
+def test_required_extension_runs_tiers_5_and_6(monkeypatch):
+    img = render(UPC)
+    calls = count_decodes(monkeypatch)
+
+    result = scanner.scan_barcode(img, img, require_extension=True)
+
+    assert result == {'main': UPC, 'extension': None}
+    # Tiers 1-3 decode 5 images; Tier 5 adds 4 angles, then Tier 6 runs for both rotations
+    assert len(calls) > 9
+
+def test_spent_budget_stops_before_crop(monkeypatch):
+    img = render(UPC)
+    monkeypatch.setattr(scanner, "EXTENSION_SEARCH_BUDGET_MS", 0)
+    calls = count_decodes(monkeypatch)
+
+    result = scanner.scan_barcode(img, img, cropped=img)
+
+    assert result == {'main': UPC, 'extension': None}
+    assert len(calls) == 5
+
+def test_unspent_budget_tries_crop(monkeypatch):
+    img = render(UPC)
+    monkeypatch.setattr(scanner, "EXTENSION_SEARCH_BUDGET_MS", 60_000)
+    calls = count_decodes(monkeypatch)
+
+    result = scanner.scan_barcode(img, img, cropped=img)
+
+    assert result == {'main': UPC, 'extension': None}
+    # Tier 4 adds the crop and its enhanced copy
+    assert len(calls) == 7
+
+def test_required_extension_ignores_budget(monkeypatch):
+    img = render(UPC)
+    monkeypatch.setattr(scanner, "EXTENSION_SEARCH_BUDGET_MS", 0)
+    calls = count_decodes(monkeypatch)
+
+    scanner.scan_barcode(img, img, cropped=img, require_extension=True)
+
+    assert len(calls) > 7
+
+def test_detected_upc_returns_without_decoding(monkeypatch):
+    img = render(UPC, EXTENSION)
+    forbid(monkeypatch, "try_decode")
+
+    assert scanner.scan_barcode(img, img, detected_upc=UPC) == {'main': UPC, 'extension': None}
+
+def test_detected_upc_still_searches_for_required_extension(monkeypatch):
+    img = render(UPC, EXTENSION)
+    calls = count_decodes(monkeypatch)
+
+    result = scanner.scan_barcode(img, img, detected_upc=UPC, require_extension=True)
+
+    assert result == {'main': UPC, 'extension': EXTENSION}
+    assert len(calls) == 1
+
+def test_detected_upc_wins_over_zbar_main():
+    img = render(UPC, EXTENSION)
+    detected = "012345678905"
+
+    result = scanner.scan_barcode(img, img, detected_upc=detected, require_extension=True)
+
+    assert result == {'main': detected, 'extension': EXTENSION}
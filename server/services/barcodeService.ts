@@ -21,7 +21,8 @@ export async function scanBarcode(imageBuffer: Buffer): Promise<BarcodeResult |
     const controller = new AbortController();
     const timeoutId = setTimeout(() => controller.abort(), BARCODE_TIMEOUT_MS);
 
-    const response = await fetch(`${PYTHON_SERVICE_URL}/scan`, {
+    // Comic lookups need the 5-digit extension, so ask the scanner to keep looking for it
+    const response = await fetch(`${PYTHON_SERVICE_URL}/scan?require_extension=true`, {
       method: 'POST',
       body: formData,
       signal: controller.signal,